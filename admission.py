@@ -0,0 +1,171 @@
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+class Overloaded(Exception):
+    """Raised when an endpoint's or a user's wait queue is full"""
+
+    def __init__(self, endpoint: str, retry_after: int, reason: str = None):
+        super().__init__(f"Server busy: {reason or f'{endpoint} queue is full'}")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+@dataclass
+class EndpointLimit:
+    """Admission limits for one endpoint
+
+    Args:
+        concurrency: Maximum number of requests running at once
+        queue_size: Maximum number of requests waiting for a slot
+        priority: Lower values are admitted first when a slot frees up
+        retry_after: Seconds advertised in Retry-After when rejecting
+    """
+    concurrency: int
+    queue_size: int
+    priority: int = 0
+    retry_after: int = 1
+
+
+@dataclass
+class _Waiter:
+    endpoint: str
+    user_id: Optional[str]
+    seq: int
+    future: asyncio.Future = field(repr=False)
+
+
+class AdmissionController:
+    """Bounded, prioritised admission to a shared pool of CPU-bound work.
+
+    Every guarded request needs one of ``pool_size`` slots. Requests that
+    cannot start immediately wait in a per-endpoint queue; once that queue,
+    or the user's share of queue places, is full new requests are rejected
+    with ``Overloaded``. When a slot frees up, waiters are admitted by
+    endpoint priority, then by how few requests their user already has in
+    flight, then in arrival order.
+
+    Args:
+        limits: Admission limits per endpoint name
+        pool_size: Slots shared by all endpoints
+        per_user_limit: Optional cap on one user's running requests
+        per_user_queue_limit: Optional cap on one user's queued requests
+    """
+
+    def __init__(self, limits: dict[str, EndpointLimit], pool_size: int, per_user_limit: Optional[int] = None,
+                 per_user_queue_limit: Optional[int] = None):
+        self.limits = limits
+        self.pool_size = pool_size
+        self.per_user_limit = per_user_limit
+        self.per_user_queue_limit = per_user_queue_limit
+        self._in_flight = {endpoint: 0 for endpoint in limits}
+        self._rejected = {endpoint: 0 for endpoint in limits}
+        self._user_in_flight: dict[str, int] = {}
+        self._waiting: list[_Waiter] = []
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, user_id: Optional[str] = None):
+        """Hold a slot for ``endpoint`` for the duration of the block"""
+        await self.acquire(endpoint, user_id)
+        try:
+            yield
+        finally:
+            self.release(endpoint, user_id)
+
+    async def acquire(self, endpoint: str, user_id: Optional[str] = None):
+        """Wait for a slot, raising ``Overloaded`` if the queue is full"""
+        limit = self.limits[endpoint]
+        waiter = _Waiter(endpoint, user_id, next(self._seq), asyncio.get_running_loop().create_future())
+        self._waiting.append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            return
+
+        # Reject the user causing a burst before the shared queue fills up
+        if (user_id is not None and self.per_user_queue_limit is not None
+                and self._queued_for_user(user_id) > self.per_user_queue_limit):
+            self._waiting.remove(waiter)
+            self._rejected[endpoint] += 1
+            raise Overloaded(endpoint, limit.retry_after, f"too many queued requests for user {user_id}")
+
+        if self._queued(endpoint) > limit.queue_size:
+            self._waiting.remove(waiter)
+            self._rejected[endpoint] += 1
+            raise Overloaded(endpoint, limit.retry_after)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                # _dispatch may already have dropped it from the queue
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+            else:
+                # The slot was granted just before the cancellation landed
+                self.release(endpoint, user_id)
+            raise
+
+    def release(self, endpoint: str, user_id: Optional[str] = None):
+        """Return a slot to the pool and admit the next waiter"""
+        self._in_flight[endpoint] -= 1
+        if user_id is not None:
+            remaining = self._user_in_flight[user_id] - 1
+            if remaining:
+                self._user_in_flight[user_id] = remaining
+            else:
+                del self._user_in_flight[user_id]
+        self._dispatch()
+
+    def snapshot(self) -> dict:
+        """Current in-flight and queued counts, per endpoint and overall"""
+        return {
+            "pool_size": self.pool_size,
+            "in_flight": sum(self._in_flight.values()),
+            "queued": len(self._waiting),
+            "endpoints": {
+                endpoint: {
+                    "in_flight": self._in_flight[endpoint],
+                    "queued": self._queued(endpoint),
+                    "rejected": self._rejected[endpoint],
+                    "concurrency": limit.concurrency,
+                    "queue_size": limit.queue_size
+                }
+                for endpoint, limit in self.limits.items()
+            }
+        }
+
+    def _queued(self, endpoint: str) -> int:
+        return sum(1 for waiter in self._waiting if waiter.endpoint == endpoint)
+
+    def _queued_for_user(self, user_id: str) -> int:
+        return sum(1 for waiter in self._waiting if waiter.user_id == user_id)
+
+    def _eligible(self, waiter: _Waiter) -> bool:
+        if self._in_flight[waiter.endpoint] >= self.limits[waiter.endpoint].concurrency:
+            return False
+        if waiter.user_id is not None and self.per_user_limit is not None:
+            return self._user_in_flight.get(waiter.user_id, 0) < self.per_user_limit
+        return True
+
+    def _dispatch(self):
+        # A waiter whose task was cancelled has a cancelled future but stays
+        # queued until that task runs again; it must not be given a slot
+        self._waiting = [waiter for waiter in self._waiting if not waiter.future.done()]
+        while self._waiting and sum(self._in_flight.values()) < self.pool_size:
+            candidates = [waiter for waiter in self._waiting if self._eligible(waiter)]
+            if not candidates:
+                return
+            waiter = min(candidates, key=lambda w: (
+                self.limits[w.endpoint].priority,
+                self._user_in_flight.get(w.user_id, 0),
+                w.seq
+            ))
+            self._waiting.remove(waiter)
+            self._in_flight[waiter.endpoint] += 1
+            if waiter.user_id is not None:
+                self._user_in_flight[waiter.user_id] = self._user_in_flight.get(waiter.user_id, 0) + 1
+            waiter.future.set_result(None)
@@ -0,0 +1,93 @@
+"""
+Cold-start benchmark: import time and time to first successful /sign.
+
+Every run starts a fresh interpreter, so nothing is cached between runs.
+Exits with status 1 if the median of either measurement is over budget.
+The default budgets are the medians measured on the reference machine
+(about 370 ms and 500 ms) plus roughly 20% for noise.
+
+    python bench_startup.py --runs 5 --import-budget-ms 450 --first-sign-budget-ms 600
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+
+from crypto.user_keys import UserKeyManager
+
+BENCH_USER = "startup_bench_user"
+
+# Runs in the child interpreter. The TestClient setup is excluded from the
+# first /sign time because a real server does not pay for it.
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(app)
+client_ready = time.perf_counter()
+response = client.post(
+    "/sign",
+    files={"document": ("bench.txt", b"Startup benchmark document")},
+    data={"signature_base64": "QmVuY2htYXJr", "user_id": sys.argv[1]}
+)
+signed = time.perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import_ms": (imported - start) * 1000,
+    "first_sign_ms": (signed - start - (client_ready - imported)) * 1000
+}))
+"""
+
+def run_once() -> dict:
+    """Measure one cold start in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, BENCH_USER],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    if measurement["status"] != 200:
+        raise RuntimeError(f"/sign returned {measurement['status']}: {result.stdout}")
+    return measurement
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=450)
+    parser.add_argument("--first-sign-budget-ms", type=float, default=600)
+    args = parser.parse_args()
+
+    # Keys are created ahead of time; a cold start signs with existing keys
+    key_manager = UserKeyManager()
+    created_user = not key_manager.user_exists(BENCH_USER)
+    if created_user:
+        key_manager.generate_user_keys(BENCH_USER)
+
+    try:
+        runs = [run_once() for _ in range(args.runs)]
+    finally:
+        if created_user:
+            shutil.rmtree(os.path.join(key_manager.keys_dir, BENCH_USER), ignore_errors=True)
+        output_path = os.path.join("output", f"signed_document_{BENCH_USER}.json")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    import_ms = statistics.median(run["import_ms"] for run in runs)
+    first_sign_ms = statistics.median(run["first_sign_ms"] for run in runs)
+    print(f"Import time (median of {args.runs}):        {import_ms:8.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+    print(f"Time to first /sign (median of {args.runs}): {first_sign_ms:8.1f} ms (budget {args.first_sign_budget_ms:.0f} ms)")
+
+    over_budget = import_ms > args.import_budget_ms or first_sign_ms > args.first_sign_budget_ms
+    if over_budget:
+        print("❌ Startup budget exceeded")
+        sys.exit(1)
+    print("✅ Startup within budget")
+
+if __name__ == "__main__":
+    main()
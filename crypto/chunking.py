@@ -0,0 +1,136 @@
+import hashlib
+
+# Chunk size bounds in bytes. Boundaries depend only on content, so an edit
+# changes the chunks around it and leaves the rest of the document's chunks
+# (and their hashes) as they were.
+MIN_CHUNK_SIZE = 4 * 1024
+AVG_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+
+CHUNKING_ALGORITHM = "FastCDC-gear32"
+
+# Gear table for the rolling hash. It is derived from SHA-256 rather than a
+# random seed so that boundaries stay stable across processes and releases;
+# changing it would stop new revisions deduplicating against stored chunks.
+GEAR = tuple(
+    int.from_bytes(hashlib.sha256(b"gear" + bytes([i])).digest()[:4], "big")
+    for i in range(256)
+)
+
+
+def _masks(avg_size: int) -> tuple[int, int]:
+    # Normalized chunking: a stricter mask before the average size and a
+    # looser one after it pulls chunk sizes towards the average. The masks
+    # use the top bits of the 32-bit hash, which depend on the last 32 bytes.
+    bits = avg_size.bit_length() - 1
+    strict = ((1 << (bits + 2)) - 1) << (32 - bits - 2)
+    loose = ((1 << (bits - 2)) - 1) << (32 - bits + 2)
+    return strict, loose
+
+
+def chunk_boundaries(data: bytes, min_size: int = MIN_CHUNK_SIZE, avg_size: int = AVG_CHUNK_SIZE,
+                     max_size: int = MAX_CHUNK_SIZE) -> list[int]:
+    """
+    Split data into content-defined chunks
+
+    Args:
+        data: The document to split
+        min_size: Smallest chunk, except for the last one
+        avg_size: Target average chunk size, must be a power of two
+        max_size: Largest chunk
+
+    Returns:
+        list: The end offset of each chunk, in order
+    """
+    strict, loose = _masks(avg_size)
+    gear = GEAR
+    view = memoryview(data)
+    length = len(data)
+    ends = []
+    start = 0
+
+    while start < length:
+        end = min(start + max_size, length)
+        if end - start <= min_size:
+            ends.append(end)
+            break
+
+        normal = min(start + avg_size, end)
+        cut = end
+        h = 0
+        position = start + min_size
+        for byte in view[position:normal]:
+            h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+            position += 1
+            if not h & strict:
+                cut = position
+                break
+        else:
+            for byte in view[normal:end]:
+                h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+                position += 1
+                if not h & loose:
+                    cut = position
+                    break
+
+        ends.append(cut)
+        start = cut
+
+    return ends
+
+
+def manifest_mismatch(data: bytes, manifest: list) -> int | None:
+    """
+    Check data against a chunk manifest without re-chunking it
+
+    The manifest's sizes say where each chunk starts, so this only hashes
+    the data once.
+
+    Returns:
+        int: Byte offset of the first chunk that does not match, or None if
+        the data matches the manifest exactly
+    """
+    view = memoryview(data)
+    start = 0
+    for chunk_id, size in manifest:
+        end = start + size
+        if end > len(data) or hashlib.sha256(view[start:end]).hexdigest() != chunk_id:
+            return start
+        start = end
+    return None if start == len(data) else start
+
+
+def match_parent_chunks(data: bytes, parent_manifest: list) -> tuple[list, int, int, list]:
+    """
+    Find the parent revision's chunks that are unchanged at each end of data
+
+    Chunks are matched by hashing data at the parent's chunk offsets, counted
+    from the start for leading chunks and from the end for trailing ones, so
+    only the region in between needs content-defined chunking.
+
+    Returns:
+        tuple: The matching leading manifest entries, the start and end
+        offsets of the changed region, and the matching trailing entries
+    """
+    view = memoryview(data)
+    length = len(data)
+
+    head = []
+    start = 0
+    for chunk_id, size in parent_manifest:
+        end = start + size
+        if end > length or hashlib.sha256(view[start:end]).hexdigest() != chunk_id:
+            break
+        head.append([chunk_id, size])
+        start = end
+
+    tail = []
+    end = length
+    for chunk_id, size in reversed(parent_manifest[len(head):]):
+        if end - size < start or hashlib.sha256(view[end - size:end]).hexdigest() != chunk_id:
+            break
+        tail.append([chunk_id, size])
+        end -= size
+    tail.reverse()
+
+    return head, start, end, tail
@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+import re
+import tempfile
+from pathlib import Path
+from typing import Iterator
+from .chunking import chunk_boundaries, match_parent_chunks
+
+PACKAGE_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def _write_atomic(path: str, data: bytes):
+    """Write via a temporary file so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class RevisionStore:
+    """Content-addressed chunk storage and signed revision packages
+
+    Chunks are stored once, under their SHA-256, no matter how many
+    revisions reference them.
+    """
+
+    def __init__(self, store_dir: str = "output/revisions"):
+        self.chunks_dir = os.path.join(store_dir, "chunks")
+        self.packages_dir = os.path.join(store_dir, "packages")
+        Path(self.chunks_dir).mkdir(parents=True, exist_ok=True)
+        Path(self.packages_dir).mkdir(parents=True, exist_ok=True)
+
+    def _chunk_path(self, chunk_id: str) -> str:
+        return os.path.join(self.chunks_dir, chunk_id[:2], chunk_id)
+
+    def _package_path(self, package_id: str) -> str:
+        if not PACKAGE_ID_PATTERN.fullmatch(package_id):
+            raise ValueError(f"Invalid package ID {package_id}")
+        return os.path.join(self.packages_dir, f"{package_id}.json")
+
+    def put_document(self, document_data: bytes, parent_manifest: list = None) -> tuple[list[list], int]:
+        """Chunk a document and store the chunks not already present
+
+        With the parent revision's manifest, chunks unchanged at the start
+        and end of the document are reused as they are, and only the region
+        between them is chunked and stored.
+
+        Returns:
+            tuple: The chunk manifest and the number of bytes newly stored
+        """
+        if parent_manifest:
+            head, start, end, tail = match_parent_chunks(document_data, parent_manifest)
+        else:
+            head, start, end, tail = [], 0, len(document_data), []
+
+        view = memoryview(document_data)
+        manifest = head
+        new_bytes = 0
+        offset = start
+        for boundary in chunk_boundaries(view[start:end]):
+            chunk_end = start + boundary
+            chunk = view[offset:chunk_end]
+            chunk_id = hashlib.sha256(chunk).hexdigest()
+            chunk_path = self._chunk_path(chunk_id)
+            if not os.path.exists(chunk_path):
+                Path(os.path.dirname(chunk_path)).mkdir(exist_ok=True)
+                _write_atomic(chunk_path, chunk)
+                new_bytes += chunk_end - offset
+            manifest.append([chunk_id, chunk_end - offset])
+            offset = chunk_end
+        manifest.extend(tail)
+        return manifest, new_bytes
+
+    def read_document(self, manifest: list) -> Iterator[bytes]:
+        """Reassemble a document from its chunks, checking each one's hash"""
+        for chunk_id, size in manifest:
+            with open(self._chunk_path(chunk_id), "rb") as f:
+                chunk = f.read()
+            if len(chunk) != size or hashlib.sha256(chunk).hexdigest() != chunk_id:
+                raise ValueError(f"Chunk {chunk_id} is corrupt")
+            yield chunk
+
+    def save_package(self, signed_package: dict):
+        """Store a signed revision package under its package ID"""
+        path = self._package_path(signed_package["package_id"])
+        _write_atomic(path, json.dumps(signed_package).encode())
+
+    def load_package(self, package_id: str) -> dict:
+        """Load a signed revision package
+
+        Raises:
+            ValueError: If the package ID is malformed or unknown
+        """
+        path = self._package_path(package_id)
+        if not os.path.exists(path):
+            raise ValueError(f"Package {package_id} not found")
+        with open(path, "rb") as f:
+            return json.load(f)
@@ -60,6 +60,7 @@ def sign_document(document_data: bytes, signature_base64: str, user_id: str, out
         "signature": base64.b64encode(signature).decode(),
         "hash_algorithm": "SHA-256",
         "user_id": user_id,  # Include user ID in package
+        "key_fingerprint": key_manager.get_public_key_info(user_id).fingerprint,
         "signed_data": data_to_sign
     }
 
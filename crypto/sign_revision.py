@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timezone
+from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from .chunking import CHUNKING_ALGORITHM, MIN_CHUNK_SIZE, AVG_CHUNK_SIZE, MAX_CHUNK_SIZE
+from .revision_store import RevisionStore
+from .user_keys import UserKeyManager
+
+def sign_revision(document_data: bytes, signature_base64: str, user_id: str, parent_package_id: str = None,
+                  store: RevisionStore = None):
+    """
+    Sign a document revision, storing only the chunks not already stored
+
+    Instead of embedding the document, the package carries a manifest of
+    the document's content-defined chunks and is signed over that manifest.
+    Chunks shared with earlier revisions are not stored again, and with a
+    parent only the region that changed since the parent is chunked.
+
+    Args:
+        document_data: The document to sign
+        signature_base64: Base64 encoded signature image
+        user_id: ID of the user signing the document
+        parent_package_id: Optional package ID of the revision this one replaces
+        store: Optional revision store, defaults to output/revisions
+
+    Returns:
+        dict: The signed package, including its package_id
+    """
+    # Initialize key manager and get user's private key
+    key_manager = UserKeyManager()
+    if not key_manager.user_exists(user_id):
+        raise ValueError(f"User {user_id} does not have keys. Generate keys first.")
+
+    private_key_path, _ = key_manager.get_user_keys(user_id)
+    store = store or RevisionStore()
+
+    # A revision can only extend the same user's revision history
+    parent_manifest = None
+    if parent_package_id:
+        parent_package = store.load_package(parent_package_id)
+        if parent_package.get("user_id") != user_id:
+            raise ValueError(f"Package {parent_package_id} was not signed by user {user_id}")
+        parent_manifest = parent_package["signed_data"]["chunk_manifest"]
+
+    # Store any new chunks and build the manifest, chunking only what changed
+    manifest, new_bytes = store.put_document(document_data, parent_manifest)
+
+    # Generate timestamp
+    timestamp = datetime.now(timezone.utc).isoformat()
+
+    # Prepare data to sign
+    data_to_sign = {
+        "chunk_manifest": manifest,
+        "document_size": len(document_data),
+        "parent_package_id": parent_package_id,
+        "signature_image": signature_base64,
+        "timestamp": timestamp,
+        "user_id": user_id
+    }
+
+    # Create hash and sign
+    json_data = json.dumps(data_to_sign, sort_keys=True).encode()
+    hash_digest = hashlib.sha256(json_data).digest()
+
+    with open(private_key_path, 'rb') as key_file:
+        private_key = serialization.load_pem_private_key(key_file.read(), password=None)
+
+    signature = private_key.sign(
+        hash_digest,
+        padding.PSS(
+            mgf=padding.MGF1(hashes.SHA256()),
+            salt_length=padding.PSS.MAX_LENGTH
+        ),
+        hashes.SHA256()
+    )
+
+    # Create signed package
+    return {
+        "package_id": hash_digest.hex(),
+        "parent_package_id": parent_package_id,
+        "timestamp": timestamp,
+        "signature": base64.b64encode(signature).decode(),
+        "hash_algorithm": "SHA-256",
+        "user_id": user_id,
+        "key_fingerprint": key_manager.get_public_key_info(user_id).fingerprint,
+        "chunking": {
+            "algorithm": CHUNKING_ALGORITHM,
+            "min_size": MIN_CHUNK_SIZE,
+            "avg_size": AVG_CHUNK_SIZE,
+            "max_size": MAX_CHUNK_SIZE
+        },
+        "revision_stats": {
+            "chunks": len(manifest),
+            "new_bytes": new_bytes,
+            "reused_bytes": len(document_data) - new_bytes
+        },
+        "signed_data": data_to_sign
+    }
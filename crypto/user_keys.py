@@ -1,15 +1,73 @@
 import os
+import base64
+import hashlib
+from dataclasses import dataclass
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 from pathlib import Path
 
+
+# How packages are signed. This is not a JOSE algorithm: JOSE PS256 uses a
+# 32-byte salt over the message, while packages use the maximum salt length
+# over the SHA-256 digest of the canonical signed data.
+SIGNATURE_SCHEME = "RSASSA-PSS-SHA256-MAXSALT-PREHASHED"
+
+
+@dataclass(frozen=True)
+class PublicKeyInfo:
+    """A user's public key in the forms needed for distribution"""
+    user_id: str
+    public_key: rsa.RSAPublicKey
+    pem: str
+    fingerprint: str
+
+    def to_jwk(self) -> dict:
+        """Return the key as an RFC 7517 JSON Web Key
+
+        There is no "alg" member, since no JOSE algorithm matches how
+        packages are signed; "signature_scheme" names the scheme instead.
+        """
+        numbers = self.public_key.public_numbers()
+        return {
+            "kty": "RSA",
+            "kid": self.fingerprint,
+            "use": "sig",
+            "signature_scheme": SIGNATURE_SCHEME,
+            "n": _b64url_uint(numbers.n),
+            "e": _b64url_uint(numbers.e),
+            "user_id": self.user_id
+        }
+
+
+def _b64url_uint(value: int) -> str:
+    raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def public_key_fingerprint(public_key) -> str:
+    """SHA-256 hex digest of the DER-encoded SubjectPublicKeyInfo"""
+    der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return hashlib.sha256(der).hexdigest()
+
+
+# Parsed public keys, keyed by path and validated against the file's
+# mtime and size so that a replaced key is picked up on the next lookup.
+_public_key_cache: dict[str, tuple[tuple[int, int], PublicKeyInfo]] = {}
+
 class UserKeyManager:
     def __init__(self, keys_dir: str = "keys/users"):
         self.keys_dir = keys_dir
         Path(keys_dir).mkdir(parents=True, exist_ok=True)
 
     def generate_user_keys(self, user_id: str) -> tuple[str, str]:
-        """Generate RSA key pair for a user and return paths to the keys"""
+        """Generate RSA key pair for a user and return paths to the keys
+
+        Raises FileExistsError if the user already has a private key, so two
+        concurrent calls cannot overwrite each other's key pair.
+        """
         # Create user directory
         user_dir = os.path.join(self.keys_dir, user_id)
         Path(user_dir).mkdir(exist_ok=True)
@@ -20,9 +78,9 @@ class UserKeyManager:
             key_size=2048
         )
 
-        # Save private key
+        # Save private key, failing if another call already created it
         private_key_path = os.path.join(user_dir, "private_key.pem")
-        with open(private_key_path, "wb") as f:
+        with open(private_key_path, "xb") as f:
             f.write(private_key.private_bytes(
                 encoding=serialization.Encoding.PEM,
                 format=serialization.PrivateFormat.PKCS8,
@@ -55,4 +113,31 @@ class UserKeyManager:
         user_dir = os.path.join(self.keys_dir, user_id)
         private_key_path = os.path.join(user_dir, "private_key.pem")
         public_key_path = os.path.join(user_dir, "public_key.pem")
-        return os.path.exists(private_key_path) and os.path.exists(public_key_path) 
\ No newline at end of file
+        return os.path.exists(private_key_path) and os.path.exists(public_key_path)
+
+    def list_users(self) -> list[str]:
+        """Return the IDs of all users with a key pair, sorted"""
+        with os.scandir(self.keys_dir) as entries:
+            return sorted(entry.name for entry in entries if entry.is_dir() and self.user_exists(entry.name))
+
+    def get_public_key_info(self, user_id: str) -> PublicKeyInfo:
+        """Load a user's public key, reusing the parsed key while the file is unchanged"""
+        _, public_key_path = self.get_user_keys(user_id)
+        stat = os.stat(public_key_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        cached = _public_key_cache.get(public_key_path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with open(public_key_path, "rb") as f:
+            pem = f.read()
+        public_key = serialization.load_pem_public_key(pem)
+        info = PublicKeyInfo(
+            user_id=user_id,
+            public_key=public_key,
+            pem=pem.decode(),
+            fingerprint=public_key_fingerprint(public_key)
+        )
+        _public_key_cache[public_key_path] = (version, info)
+        return info
@@ -1,8 +1,9 @@
 import base64
 import hashlib
 import json
-from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
+from .chunking import manifest_mismatch
 from .user_keys import UserKeyManager
 
 def verify_signature(document_data: bytes, signature_base64: str, signed_package_data: dict) -> dict:
@@ -45,7 +46,17 @@ def verify_signature(document_data: bytes, signature_base64: str, signed_package
                 "error": f"Keys not found for user {user_id}"
             }
         
-        _, public_key_path = key_manager.get_user_keys(user_id)
+        key_info = key_manager.get_public_key_info(user_id)
+        
+        # Reject packages signed with a different key than the one on file
+        key_fingerprint = signed_package_data.get('key_fingerprint')
+        if key_fingerprint and key_fingerprint != key_info.fingerprint:
+            return {
+                "valid": False,
+                "timestamp": None,
+                "user_id": None,
+                "error": f"Key fingerprint mismatch for user {user_id}"
+            }
         
         # Reconstruct the data that was signed
         data_to_verify = {
@@ -59,13 +70,9 @@ def verify_signature(document_data: bytes, signature_base64: str, signed_package
         json_data = json.dumps(data_to_verify, sort_keys=True).encode()
         hash_digest = hashlib.sha256(json_data).digest()
         
-        # Load the public key
-        with open(public_key_path, 'rb') as key_file:
-            public_key = serialization.load_pem_public_key(key_file.read())
-        
         # Verify the signature
         try:
-            public_key.verify(
+            key_info.public_key.verify(
                 signature,
                 hash_digest,
                 padding.PSS(
@@ -98,3 +105,80 @@ def verify_signature(document_data: bytes, signature_base64: str, signed_package
             "user_id": None,
             "error": f"Verification error: {str(e)}"
         }
+
+def verify_revision_signature(document_data: bytes, signature_base64: str, signed_package_data: dict) -> dict:
+    """
+    Verify a signed revision package against a document
+    
+    The document is checked against the package's chunk manifest by hashing
+    it at the manifest's chunk offsets, so it does not need to be re-chunked.
+    
+    Args:
+        document_data: The document to verify
+        signature_base64: The original signature image
+        signed_package_data: The signed revision package
+    
+    Returns:
+        dict: Verification result in the same form as verify_signature
+    """
+    def failure(error: str) -> dict:
+        print(f"❌ Revision verification failed: {error}")
+        return {
+            "valid": False,
+            "timestamp": None,
+            "user_id": None,
+            "error": error
+        }
+
+    try:
+        signed_data = signed_package_data.get('signed_data', {})
+        signature = base64.b64decode(signed_package_data.get('signature', ''))
+        user_id = signed_data.get('user_id')
+        
+        if not user_id:
+            return failure("No user ID found in signed package")
+        
+        # Initialize key manager and get user's public key
+        key_manager = UserKeyManager()
+        if not key_manager.user_exists(user_id):
+            return failure(f"Keys not found for user {user_id}")
+        
+        key_info = key_manager.get_public_key_info(user_id)
+        key_fingerprint = signed_package_data.get('key_fingerprint')
+        if key_fingerprint and key_fingerprint != key_info.fingerprint:
+            return failure(f"Key fingerprint mismatch for user {user_id}")
+        
+        # Check the document and signature image against what was signed
+        mismatch = manifest_mismatch(document_data, signed_data.get('chunk_manifest', []))
+        if mismatch is not None:
+            return failure(f"Document does not match chunk manifest at byte {mismatch}")
+        if signed_data.get('signature_image') != signature_base64:
+            return failure("Signature image does not match")
+        
+        # Create the same hash that was signed
+        json_data = json.dumps(signed_data, sort_keys=True).encode()
+        hash_digest = hashlib.sha256(json_data).digest()
+        
+        # Verify the signature
+        try:
+            key_info.public_key.verify(
+                signature,
+                hash_digest,
+                padding.PSS(
+                    mgf=padding.MGF1(hashes.SHA256()),
+                    salt_length=padding.PSS.MAX_LENGTH
+                ),
+                hashes.SHA256()
+            )
+        except Exception as e:
+            return failure(f"Signature verification failed: {str(e)}")
+        
+        print(f"✅ Revision signature verified successfully for user {user_id}!")
+        return {
+            "valid": True,
+            "timestamp": signed_data.get('timestamp'),
+            "user_id": user_id,
+            "error": None
+        }
+    except Exception as e:
+        return failure(f"Verification error: {str(e)}")
@@ -0,0 +1,134 @@
+import json
+import zlib
+from typing import Iterator, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# orjson and zstandard are optional: orjson is several times faster than the
+# stdlib on packages dominated by a large base64 string, and zstandard adds
+# zstd as a negotiable content encoding. Without them we fall back to the
+# stdlib json module and gzip only.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_BACKEND = "orjson" if orjson else "json"
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Supported content encodings, in server preference order
+ENCODINGS = ("zstd", "gzip") if zstandard else ("gzip",)
+
+
+def dumps(obj) -> bytes:
+    """Serialize obj to compact UTF-8 JSON"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def loads(data: bytes):
+    """Parse JSON, raising json.JSONDecodeError on invalid input"""
+    if orjson:
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the best supported encoding from an Accept-Encoding header
+
+    Returns None when the client accepts none of them.
+    """
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[token.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress body with a negotiated content encoding"""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+def encoded_response(request: Request, body: bytes, status_code: int = 200) -> Response:
+    """Send an already-serialized JSON body, compressed if the client accepts it
+
+    Passing bytes skips FastAPI's jsonable_encoder pass over the content.
+    The body is compressed here, in full, rather than while it is sent, so
+    call this from the threadpool inside the request's admission slot to
+    keep the compression CPU under the admission limits.
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+
+    if encoding is not None:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def decompress(data: bytes, max_size: int) -> bytes:
+    """Decompress gzip or zstd data, detected by magic number
+
+    Uncompressed data is returned unchanged. Raises ValueError if the data
+    is corrupt, uses an unsupported encoding, or inflates beyond max_size.
+    """
+    if data[:2] == GZIP_MAGIC:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            result = decompressor.decompress(data, max_size + 1)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip data: {e}") from e
+        if not decompressor.eof and len(result) <= max_size:
+            raise ValueError("Invalid gzip data: truncated stream")
+    elif data[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("zstd-compressed data is not supported: zstandard is not installed")
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                result = reader.read(max_size + 1)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Invalid zstd data: {e}") from e
+    else:
+        return data
+
+    if len(result) > max_size:
+        raise ValueError(f"Decompressed data exceeds {max_size} bytes")
+    return result
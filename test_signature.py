@@ -1,9 +1,22 @@
 import os
 import base64
 import json
+import asyncio
+import gzip
+import hashlib
+import subprocess
+import sys
+import httpx
+from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives.asymmetric import padding
 from fastapi.testclient import TestClient
 from app import app
+import json_codec
+from admission import AdmissionController, EndpointLimit, Overloaded
 from crypto.user_keys import UserKeyManager
+from crypto.sign_document import sign_document
+from crypto.chunking import MAX_CHUNK_SIZE, match_parent_chunks
+from crypto.verify_signature import verify_revision_signature
 
 # Create test client
 client = TestClient(app)
@@ -127,7 +140,7 @@ def test_signature_verification(user_id, signed_package):
         assert response.status_code == 200
         verification_result = response.json()
         assert verification_result["valid"] == True
-        assert verification_result["user_id"] == user_id
+        assert verification_result["details"]["user_id"] == user_id
         print("✅ Signature verification successful")
     except Exception as e:
         print(f"Error in signature verification test: {str(e)}")
@@ -172,6 +185,470 @@ def test_error_cases():
         print(f"Error in error cases test: {str(e)}")
         raise
 
+def test_admission_control():
+    """Test admission queueing, priority and rejection"""
+    print("\n=== Testing Admission Control ===")
+
+    async def scenario():
+        controller = AdmissionController(
+            limits={
+                "verify": EndpointLimit(concurrency=1, queue_size=1, priority=0),
+                "sign": EndpointLimit(concurrency=1, queue_size=1, priority=1, retry_after=3)
+            },
+            pool_size=1
+        )
+        order = []
+
+        async def run(endpoint):
+            async with controller.slot(endpoint):
+                order.append(endpoint)
+                await asyncio.sleep(0)
+
+        # Hold the only slot so that everything else has to queue
+        await controller.acquire("sign")
+        sign_task = asyncio.create_task(run("sign"))
+        verify_task = asyncio.create_task(run("verify"))
+        await asyncio.sleep(0)
+
+        snapshot = controller.snapshot()
+        assert snapshot["in_flight"] == 1
+        assert snapshot["endpoints"]["sign"]["queued"] == 1
+        assert snapshot["endpoints"]["verify"]["queued"] == 1
+
+        # The sign queue is full, so a third sign request is rejected
+        try:
+            await controller.acquire("sign")
+            raise AssertionError("Expected Overloaded")
+        except Overloaded as e:
+            assert e.retry_after == 3
+        assert controller.snapshot()["endpoints"]["sign"]["rejected"] == 1
+
+        controller.release("sign")
+        await asyncio.gather(sign_task, verify_task)
+        return order, controller.snapshot()
+
+    try:
+        order, snapshot = asyncio.run(scenario())
+        # Verify was queued after sign but is admitted first
+        assert order == ["verify", "sign"]
+        assert snapshot["in_flight"] == 0 and snapshot["queued"] == 0
+        print("✅ Admission control queues, prioritises and rejects correctly")
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert "sign" in response.json()["admission"]["endpoints"]
+        print("✅ Admission metrics exposed")
+    except Exception as e:
+        print(f"Error in admission control test: {str(e)}")
+        raise
+
+def test_admission_fairness():
+    """Test per-user limits and least-loaded-user ordering"""
+    print("\n=== Testing Admission Fairness ===")
+
+    async def scenario():
+        controller = AdmissionController(
+            limits={"sign": EndpointLimit(concurrency=2, queue_size=8)},
+            pool_size=2,
+            per_user_limit=2,
+            per_user_queue_limit=1
+        )
+        order = []
+
+        async def run(user_id):
+            await controller.acquire("sign", user_id)
+            order.append(user_id)
+
+        # Busy tenant holds both slots and queues first
+        await controller.acquire("sign", "busy")
+        await controller.acquire("sign", "busy")
+        busy_task = asyncio.create_task(run("busy"))
+        await asyncio.sleep(0)
+
+        # Its next request is over the per-user queue limit, another tenant's is not
+        try:
+            await controller.acquire("sign", "busy")
+            raise AssertionError("Expected Overloaded")
+        except Overloaded as e:
+            assert "busy" in str(e)
+        other_task = asyncio.create_task(run("other"))
+        await asyncio.sleep(0)
+        assert controller.snapshot()["endpoints"]["sign"]["queued"] == 2
+
+        # The freed slot goes to the tenant with nothing in flight
+        controller.release("sign", "busy")
+        await asyncio.sleep(0)
+        assert order == ["other"], order
+
+        # The busy tenant's queued request runs once another slot frees up
+        controller.release("sign", "other")
+        await asyncio.sleep(0)
+        assert order == ["other", "busy"], order
+        await asyncio.gather(busy_task, other_task)
+
+        # per_user_limit holds a tenant back even while the pool has room
+        limited = AdmissionController(
+            limits={"sign": EndpointLimit(concurrency=4, queue_size=4)},
+            pool_size=4,
+            per_user_limit=1
+        )
+        await limited.acquire("sign", "busy")
+        second = asyncio.create_task(limited.acquire("sign", "busy"))
+        await asyncio.sleep(0)
+        assert limited.snapshot()["in_flight"] == 1
+        limited.release("sign", "busy")
+        await asyncio.wait_for(second, timeout=1)
+
+    try:
+        asyncio.run(scenario())
+        print("✅ Per-user limits and least-loaded ordering enforced")
+    except Exception as e:
+        print(f"Error in admission fairness test: {str(e)}")
+        raise
+
+def test_admission_cancellation():
+    """Test that a request cancelled while queued does not leak its slot"""
+    print("\n=== Testing Admission Cancellation ===")
+
+    async def scenario():
+        controller = AdmissionController(
+            limits={"sign": EndpointLimit(concurrency=1, queue_size=4)},
+            pool_size=1
+        )
+        await controller.acquire("sign")
+        waiting_task = asyncio.create_task(controller.acquire("sign"))
+        await asyncio.sleep(0)
+
+        # Release before the cancelled task gets to run again
+        waiting_task.cancel()
+        controller.release("sign")
+        try:
+            await waiting_task
+            raise AssertionError("Expected CancelledError")
+        except asyncio.CancelledError:
+            pass
+
+        snapshot = controller.snapshot()
+        assert snapshot["in_flight"] == 0 and snapshot["queued"] == 0, snapshot
+        await asyncio.wait_for(controller.acquire("sign"), timeout=1)
+        controller.release("sign")
+
+    try:
+        asyncio.run(scenario())
+        print("✅ Cancelled waiter does not hold a slot")
+    except Exception as e:
+        print(f"Error in admission cancellation test: {str(e)}")
+        raise
+
+def test_concurrent_key_generation():
+    """Test that concurrent key generation for one user creates one key pair"""
+    print("\n=== Testing Concurrent Key Generation ===")
+
+    async def generate_twice(user_id):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(
+                async_client.post(f"/users/{user_id}/keys"),
+                async_client.post(f"/users/{user_id}/keys")
+            )
+
+    try:
+        user_id = f"test_concurrent_user_{os.getpid()}"
+        responses = asyncio.run(generate_twice(user_id))
+        assert sorted(response.status_code for response in responses) == [200, 400]
+        print("✅ Only one of two concurrent key generations succeeds")
+    except Exception as e:
+        print(f"Error in concurrent key generation test: {str(e)}")
+        raise
+
+def test_public_key_distribution():
+    """Test public key endpoints, caching headers and offline verification"""
+    print("\n=== Testing Public Key Distribution ===")
+
+    try:
+        user_id = "test_key_distribution_user"
+        key_manager = UserKeyManager()
+        if not key_manager.user_exists(user_id):
+            key_manager.generate_user_keys(user_id)
+
+        response = client.get(f"/users/{user_id}/public_key")
+        assert response.status_code == 200
+        key_data = response.json()
+        etag = response.headers["etag"]
+        assert etag == f'"{key_data["fingerprint"]}"'
+        assert "max-age" in response.headers["cache-control"]
+        print("✅ Public key published with ETag")
+
+        response = client.get(f"/users/{user_id}/public_key", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        print("✅ Conditional request returns 304")
+
+        response = client.get("/keys")
+        assert response.status_code == 200
+        kids = [key["kid"] for key in response.json()["keys"]]
+        assert key_data["fingerprint"] in kids
+        assert all("alg" not in key and key["signature_scheme"] == key_data["signature_scheme"]
+                   for key in response.json()["keys"])
+        response = client.get("/keys", headers={"If-None-Match": response.headers["etag"]})
+        assert response.status_code == 304
+        print("✅ Key set published as JWKS")
+
+        response = client.get("/users/non_existent_user/public_key")
+        assert response.status_code == 404
+        print("✅ Proper error for unknown user's key")
+
+        # /verify rejects packages whose key fingerprint or signature was changed
+        signature = create_test_signature()
+        document = b"Fingerprinted document"
+        response = client.post(
+            "/sign",
+            files={"document": ("document.txt", document)},
+            data={"signature_base64": signature, "user_id": user_id}
+        )
+        assert response.status_code == 200
+        signed_package = response.json()
+
+        def verify_package(package):
+            response = client.post(
+                "/verify",
+                files={
+                    "document": ("document.txt", document),
+                    "signed_package": ("package.json", json.dumps(package))
+                },
+                data={"signature_base64": signature}
+            )
+            return response.json()["valid"]
+
+        assert verify_package(signed_package) == True
+        assert verify_package({**signed_package, "key_fingerprint": "deadbeef"}) == False
+        zeroed_signature = base64.b64encode(bytes(len(base64.b64decode(signed_package["signature"])))).decode()
+        assert verify_package({**signed_package, "signature": zeroed_signature}) == False
+        print("✅ Changed key fingerprint or signature rejected by /verify")
+
+        # Verify a signed package offline with the published key
+        offline_document = b"offline document"
+        package = sign_document(offline_document, signature, user_id)
+        assert package["key_fingerprint"] == key_data["fingerprint"]
+        assert base64.b64encode(offline_document).decode() == package["signed_data"]["document"]
+        assert base64.b64encode(b"another document").decode() != package["signed_data"]["document"]
+        hash_digest = hashlib.sha256(json.dumps(package["signed_data"], sort_keys=True).encode()).digest()
+        public_key = serialization.load_pem_public_key(key_data["public_key_pem"].encode())
+        public_key.verify(
+            base64.b64decode(package["signature"]),
+            hash_digest,
+            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
+            hashes.SHA256()
+        )
+        print("✅ Signature verified offline with published key")
+    except Exception as e:
+        print(f"Error in public key distribution test: {str(e)}")
+        raise
+
+def test_compressed_packages():
+    """Test encoding negotiation and compressed package upload"""
+    print("\n=== Testing Compressed Packages ===")
+
+    try:
+        assert json_codec.negotiate_encoding("gzip, deflate") == "gzip"
+        assert json_codec.negotiate_encoding("gzip;q=0, br") is None
+        assert json_codec.negotiate_encoding(None) is None
+        assert json_codec.loads(json_codec.dumps({"a": [1, "b"]})) == {"a": [1, "b"]}
+        print("✅ Encoding negotiation and JSON backend work")
+
+        body = json_codec.dumps({"document": "A" * 100000})
+        compressed = json_codec.compress(body, "gzip")
+        assert json_codec.decompress(compressed, len(body)) == body
+        assert json_codec.decompress(body, len(body)) == body
+        try:
+            json_codec.decompress(compressed, 1000)
+            raise AssertionError("Expected ValueError")
+        except ValueError:
+            pass
+        print("✅ Compression round-trips and enforces size limit")
+
+        user_id = "test_compression_user"
+        key_manager = UserKeyManager()
+        if not key_manager.user_exists(user_id):
+            key_manager.generate_user_keys(user_id)
+
+        document = b"Compressed document " * 200
+        response = client.post(
+            "/sign",
+            files={"document": ("document.txt", document)},
+            data={"signature_base64": create_test_signature(), "user_id": user_id},
+            headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        signed_package = response.json()
+        assert signed_package["user_id"] == user_id
+        print("✅ Signed package sent gzip-compressed")
+
+        # A gzip-compressed package is parsed; the altered document is detected
+        response = client.post(
+            "/verify",
+            files={
+                "document": ("document.txt", document + b"tampered"),
+                "signed_package": ("package.json.gz", gzip.compress(json.dumps(signed_package).encode()))
+            },
+            data={"signature_base64": create_test_signature()}
+        )
+        assert response.status_code == 400
+        assert response.json()["message"] == "Document has been modified"
+        print("✅ Compressed signed package accepted by /verify")
+
+        # An unparseable package is not echoed back in full
+        response = client.post(
+            "/verify",
+            files={
+                "document": ("document.txt", document),
+                "signed_package": ("package.json.gz", gzip.compress(b"A" * 1024 * 1024))
+            },
+            data={"signature_base64": create_test_signature()}
+        )
+        assert response.status_code == 400
+        assert len(response.json()["details"]["received_data"]) <= 200
+        print("✅ Invalid package echoed as a short prefix only")
+    except Exception as e:
+        print(f"Error in compressed package test: {str(e)}")
+        raise
+
+# Prints whether the crypto modules were loaded before and after startup,
+# and whether the key manager was created
+WARMUP_CHECK_SCRIPT = """
+import sys
+from fastapi.testclient import TestClient
+from app import create_app, get_key_manager
+warm_app = create_app(warmup_on_startup=True)
+before = "crypto.sign_document" in sys.modules
+with TestClient(warm_app):
+    print(before, "crypto.sign_document" in sys.modules, get_key_manager.cache_info().currsize)
+"""
+
+def test_lazy_startup():
+    """Test that importing the app defers crypto imports and setup"""
+    print("\n=== Testing Lazy Startup ===")
+
+    try:
+        result = subprocess.run(
+            [sys.executable, "-c", (
+                "import sys, app; "
+                "print(sorted(m for m in sys.modules if m.split('.')[0] in ('crypto', 'cryptography', 'pytz')))"
+            )],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        assert result.stdout.strip() == "[]", result.stdout
+        print("✅ Importing app does not import crypto modules")
+
+        # A fresh interpreter, since this module already imports the crypto modules
+        result = subprocess.run(
+            [sys.executable, "-c", WARMUP_CHECK_SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        assert result.stdout.strip() == "False True 1", result.stdout
+        print("✅ Warmup hook runs deferred setup on startup")
+    except Exception as e:
+        print(f"Error in lazy startup test: {str(e)}")
+        raise
+
+def test_revision_signing():
+    """Test incremental signing of document revisions"""
+    print("\n=== Testing Revision Signing ===")
+
+    try:
+        user_id = "test_revision_user"
+        key_manager = UserKeyManager()
+        if not key_manager.user_exists(user_id):
+            key_manager.generate_user_keys(user_id)
+        signature = create_test_signature()
+
+        first = os.urandom(512 * 1024)
+        response = client.post(
+            "/sign/revision",
+            files={"document": ("contract.bin", first)},
+            data={"signature_base64": signature, "user_id": user_id}
+        )
+        assert response.status_code == 200
+        parent = response.json()
+        assert "document" not in parent["signed_data"]
+        print("✅ First revision signed with a chunk manifest")
+
+        # A small edit only stores the chunks around it
+        second = first[:200000] + b"Amended clause" + first[200000:]
+        response = client.post(
+            "/sign/revision",
+            files={"document": ("contract.bin", second)},
+            data={
+                "signature_base64": signature,
+                "user_id": user_id,
+                "parent_package_id": parent["package_id"]
+            }
+        )
+        assert response.status_code == 200
+        revision = response.json()
+        assert revision["parent_package_id"] == parent["package_id"]
+        assert revision["revision_stats"]["new_bytes"] <= 2 * MAX_CHUNK_SIZE
+        print("✅ Revision stores only changed chunks")
+
+        # Only the region around the edit needs content-defined chunking
+        head, start, end, tail = match_parent_chunks(second, parent["signed_data"]["chunk_manifest"])
+        assert head and tail
+        assert end - start <= 2 * MAX_CHUNK_SIZE + len(b"Amended clause")
+        assert revision["signed_data"]["chunk_manifest"][:len(head)] == head
+        assert revision["signed_data"]["chunk_manifest"][-len(tail):] == tail
+        print("✅ Unchanged parent chunks reused without re-chunking")
+
+        response = client.get(f"/packages/{revision['package_id']}/document")
+        assert response.status_code == 200
+        assert response.content == second
+        print("✅ Document reassembled from chunks")
+
+        response = client.post(
+            "/verify",
+            files={
+                "document": ("contract.bin", second),
+                "signed_package": ("package.json", json.dumps(revision))
+            },
+            data={"signature_base64": signature}
+        )
+        assert response.status_code == 200
+        assert response.json()["valid"] == True
+        print("✅ Revision signature verified")
+
+        # Unsigned top-level fields cannot change who is reported as the signer
+        forged = {**revision, "user_id": "someone_else", "timestamp": "1999-01-01"}
+        response = client.post(
+            "/verify",
+            files={
+                "document": ("contract.bin", second),
+                "signed_package": ("package.json", json.dumps(forged))
+            },
+            data={"signature_base64": signature}
+        )
+        details = response.json()["details"]
+        assert details["user_id"] == user_id
+        assert details["timestamp"] == revision["signed_data"]["timestamp"]
+        print("✅ Verified signer taken from signed data")
+
+        assert verify_revision_signature(first, signature, revision)["valid"] == False
+        assert verify_revision_signature(second, "invalid_signature", revision)["valid"] == False
+        print("✅ Altered revision or signature image rejected")
+
+        response = client.post(
+            "/sign/revision",
+            files={"document": ("contract.bin", second)},
+            data={"signature_base64": signature, "user_id": user_id, "parent_package_id": "0" * 64}
+        )
+        assert response.status_code == 400
+        print("✅ Proper error for unknown parent package")
+    except Exception as e:
+        print(f"Error in revision signing test: {str(e)}")
+        raise
+
 def cleanup():
     """Clean up test files"""
     print("\n=== Cleaning Up ===")
@@ -205,6 +682,14 @@ def main():
         signed_package = test_document_signing(user_id)
         test_signature_verification(user_id, signed_package)
         test_error_cases()
+        test_admission_control()
+        test_admission_fairness()
+        test_admission_cancellation()
+        test_concurrent_key_generation()
+        test_public_key_distribution()
+        test_compressed_packages()
+        test_lazy_startup()
+        test_revision_signing()
         
         print("\n✅ All tests completed successfully!")
     except AssertionError as e: